@@ -0,0 +1,135 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from fastapi import WebSocket
+
+from .encoding import dumps
+from .profiling import current_trace, section
+from .state import GameState
+from .ws import DEFAULT_TOPICS, ConnectionManager, topic_matches
+
+T = TypeVar("T")
+Event = Dict[str, Any]
+Command = Callable[[], Tuple[T, List[Event]]]
+Frame = Tuple[int, Optional[str], str]  # (seq, topic, encoded JSON text)
+
+HISTORY_SIZE = 512
+
+
+class TournamentActor:
+    """Serializes every mutation of one tournament through a single worker.
+
+    Commands run one at a time in arrival order and return ``(result, events)``.
+    Emitted events are stamped with a monotonic ``seq``, encoded to JSON once, and
+    queued on each subscriber's own outbox, so callers get their result as soon as the
+    command is applied while every socket still sees events in the order state changed.
+
+    The last ``HISTORY_SIZE`` events are kept so a reconnecting socket can resume
+    from the last ``seq`` it saw instead of receiving a full snapshot.
+    """
+
+    def __init__(self, game: GameState, manager: ConnectionManager, history_size: int = HISTORY_SIZE):
+        self.game = game
+        self.manager = manager
+        self.seq = 0
+        # Sequence numbers restart with the process; clients must resume within the same epoch
+        self.epoch = uuid.uuid4().hex
+        self.history: Deque[Frame] = deque(maxlen=history_size)
+        self._commands: Optional[asyncio.Queue] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # Every state change emits an event, so seq identifies the state a snapshot encodes
+        self._snapshots: Dict[bool, Tuple[int, str]] = {}
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._commands = asyncio.Queue()
+        self._tasks = {asyncio.create_task(self._process())}
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = set()
+
+    async def execute(self, command: Command) -> T:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._commands.put((command, future, current_trace.get(), time.perf_counter()))
+        return await future
+
+    def snapshot(self, host: bool = False) -> str:
+        # Cached per seq: after a restart every phone falls back to a snapshot at once
+        cached = self._snapshots.get(host)
+        if cached and cached[0] == self.seq:
+            return cached[1]
+        topic = "host" if host else "tournament"
+        text = dumps({"seq": self.seq, "epoch": self.epoch, "type": "state:update", "topic": topic, "data": self.game.get_state()}, public=not host).decode()
+        self._snapshots[host] = (self.seq, text)
+        return text
+
+    def catch_up(self, since: Optional[int], epoch: Optional[str], topics: Iterable[str] = DEFAULT_TOPICS) -> List[str]:
+        """Events after ``since`` on ``topics``, or a full snapshot if they are no longer buffered."""
+        topics = tuple(topics)
+        if since is None or epoch != self.epoch or since > self.seq:
+            return [self.snapshot(host="host" in topics)]
+        if since == self.seq:
+            return []
+        if not self.history or self.history[0][0] > since + 1:
+            return [self.snapshot(host="host" in topics)]
+        return [text for seq, topic, text in self.history if seq > since and topic_matches(topics, topic)]
+
+    async def join(
+        self,
+        websocket: WebSocket,
+        since: Optional[int] = None,
+        epoch: Optional[str] = None,
+        topics: Iterable[str] = DEFAULT_TOPICS,
+    ) -> None:
+        # Runs as a command: the catch-up is queued on the socket's own outbox ahead of every
+        # later event, so it lines up exactly with the live stream without blocking other sockets
+        topics = tuple(topics)
+
+        def command():
+            self.manager.add(websocket, topics, backlog=self.catch_up(since, epoch, topics))
+            return None, []
+
+        await self.execute(command)
+
+    def _emit(self, events: List[Event]) -> None:
+        # Encode while still inside the command: events may reference live models that later commands mutate
+        for event in events:
+            self.seq += 1
+            topic = event.get("topic")
+            # Only the host topic may carry challenge answers
+            text = dumps({"seq": self.seq, **event}, public=topic != "host").decode()
+            self.history.append((self.seq, topic, text))
+            with section("broadcast"):
+                self.manager.publish(text, topic)
+
+    async def _process(self) -> None:
+        while True:
+            command, future, trace, enqueued = await self._commands.get()
+            # Run under the caller's trace so persist/encode time is attributed to its request
+            token = current_trace.set(trace)
+            try:
+                if trace:
+                    trace.add("queue", time.perf_counter() - enqueued)
+                with section("command"):
+                    result, events = command()
+                    self._emit(events)
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+                continue
+            finally:
+                current_trace.reset(token)
+            if not future.done():
+                future.set_result(result)
@@ -18,5 +18,11 @@ def load_theme(theme: Theme) -> List[Challenge]:
     return [Challenge(**item) for item in data]
 
 
+def load_rapidfire() -> List[Challenge]:
+    path = CONTENT_DIR / "rapidfire.json"
+    data = json.loads(path.read_text()) if path.exists() else []
+    return [Challenge(**item) for item in data]
+
+
 def load_all() -> Dict[Theme, List[Challenge]]:
     return {theme: load_theme(theme) for theme in ["lyrics", "scene", "emoji", "trivia"]}
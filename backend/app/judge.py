@@ -0,0 +1,115 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .models import Challenge, JudgeResult
+
+EXAMPLES_PREFIX = re.compile(r"^\s*examples?\s*:\s*", re.IGNORECASE)
+ALTERNATIVES = re.compile(r"/|\s+or\s+", re.IGNORECASE)
+PARENTHETICAL = re.compile(r"\(([^)]*)\)")
+# List tails like "..., Langda Tyagi, etc." that must not become accepted answers
+FILLER = {"etc", "etc etc", "and so on", "and more", "so on", "others", "and others", "more"}
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = text.replace("&", " and ")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def split_aliases(answer: str) -> List[str]:
+    """Accepted spellings for an answer: "a / b", "a or b", "Title (Alt)" and entries of a
+    one-of list ("Examples: a, b" or "a, b, etc."). Any other comma list, such as
+    "Shah Rukh Khan, Salman Khan, Aamir Khan", has to be given in full."""
+    listed = EXAMPLES_PREFIX.sub("", answer)
+    entries = listed.split(",")
+    if listed == answer and normalize(entries[-1]) not in FILLER:
+        entries = [listed]
+    aliases: List[str] = []
+    for part in (alt for entry in entries for alt in ALTERNATIVES.split(entry)):
+        base = PARENTHETICAL.sub("", part).strip()
+        if base and normalize(base) not in FILLER:
+            aliases.append(base)
+        # Keep "(Enthiran)" style alternate titles, skip notes like "(2015)" or "(composer-singer)"
+        aliases.extend(extra.strip() for extra in PARENTHETICAL.findall(part) if extra.strip()[:1].isupper())
+    if not aliases:
+        aliases.append(answer)
+    return aliases
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up with ``limit + 1`` once it cannot stay within ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def tolerance(alias: str) -> int:
+    # Short answers ("PK", "maa") must be exact; longer ones allow roughly one typo per six letters
+    return 0 if len(alias) <= 3 else max(1, len(alias) // 6)
+
+
+class AnswerIndex:
+    """Normalized answers for every loaded challenge, built once at content load.
+
+    Each challenge keeps its aliases in exact-match form (spaced and compact) plus a
+    trigram set per alias, so judging a guess is a set lookup followed by at most a
+    few bounded edit-distance checks against trigram-similar aliases.
+    """
+
+    def __init__(self, challenges: Iterable[Challenge]):
+        self.exact: Dict[str, Dict[str, str]] = {}
+        self.fuzzy: Dict[str, List[Tuple[str, Set[str]]]] = {}
+        for challenge in challenges:
+            self.add(challenge)
+
+    def add(self, challenge: Challenge) -> None:
+        exact: Dict[str, str] = {}
+        fuzzy: List[Tuple[str, Set[str]]] = []
+        for alias in split_aliases(challenge.answer):
+            norm = normalize(alias)
+            if not norm:
+                continue
+            exact.setdefault(norm, alias)
+            exact.setdefault(norm.replace(" ", ""), alias)
+            fuzzy.append((norm, trigrams(norm)))
+        self.exact[challenge.id] = exact
+        self.fuzzy[challenge.id] = fuzzy
+
+    def judge(self, challenge: Challenge, guess: str) -> JudgeResult:
+        if challenge.id not in self.exact:
+            self.add(challenge)
+        norm = normalize(guess)
+        if not norm:
+            return JudgeResult(correct=False, challengeId=challenge.id)
+        exact = self.exact[challenge.id]
+        matched = exact.get(norm) or exact.get(norm.replace(" ", ""))
+        if matched:
+            return JudgeResult(correct=True, challengeId=challenge.id, matched=matched, distance=0)
+
+        grams = trigrams(norm)
+        best: Optional[Tuple[int, str]] = None
+        for alias, alias_grams in self.fuzzy[challenge.id]:
+            limit = tolerance(alias)
+            if not limit or len(grams & alias_grams) / len(grams | alias_grams) < 0.3:
+                continue
+            distance = edit_distance(norm, alias, limit)
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, alias)
+        if best:
+            return JudgeResult(correct=True, challengeId=challenge.id, matched=exact.get(best[1], best[1]), distance=best[0])
+        return JudgeResult(correct=False, challengeId=challenge.id)
@@ -1,18 +1,27 @@
+import json
 import os
 from pathlib import Path
 
+from typing import Optional
+
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
-from .routes import create_router
+from .actor import TournamentActor
+from .profiling import Profiler, ProfilingMiddleware
+from .routes import create_profiling_router, create_router
 from .state import GameState
-from .ws import ConnectionManager
+from .timers import RoundTimers
+from .ws import DEFAULT_TOPICS, ConnectionManager
 
 app = FastAPI(title="Couples Clash Championship")
-manager = ConnectionManager()
-game = GameState()
+profiler = Profiler()
+manager = ConnectionManager(profiler=profiler)
+timers = RoundTimers()
+game = GameState(timers=timers)
+actor = TournamentActor(game, manager)
 
 # Determine frontend dist path (works in Docker and local dev)
 FRONTEND_DIST = Path(__file__).resolve().parent.parent.parent / "frontend_dist"
@@ -26,17 +35,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.include_router(create_router(game, manager))
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+app.include_router(create_router(game, actor, profiler))
+app.include_router(create_profiling_router(profiler))
+
+
+@app.on_event("startup")
+async def start_workers():
+    actor.start()
+    timers.start()
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await timers.stop()
+    await actor.stop()
 
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    await websocket.send_json({"type": "state:update", "data": game.get_state().model_dump()})
+async def websocket_endpoint(
+    websocket: WebSocket,
+    since: Optional[int] = None,
+    epoch: Optional[str] = None,
+    topics: Optional[str] = None,
+    hostToken: Optional[str] = None,
+):
+    # Reconnecting clients pass the last seq/epoch they saw to receive only what they missed;
+    # `topics` is a comma-separated subscription list (defaults to everything but `host`)
+    subscribed = [t for t in topics.split(",") if t] if topics else DEFAULT_TOPICS
+    await websocket.accept()
     try:
+        await actor.join(websocket, since=since, epoch=epoch, topics=manager.permitted(subscribed, hostToken))
         while True:
-            await websocket.receive_text()
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                continue
+            if isinstance(message, dict):
+                await manager.dispatch(websocket, message)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
@@ -1,8 +1,12 @@
-from pydantic import BaseModel, Field
+from contextvars import ContextVar
+from pydantic import BaseModel, Field, model_serializer
 from typing import Optional, List, Dict, Literal
 
 Theme = Literal["lyrics", "scene", "emoji", "trivia"]
 
+# Set while encoding frames for non-host audiences: buzzer phones must never see answers
+public_view: ContextVar[bool] = ContextVar("public_view", default=False)
+
 
 class Team(BaseModel):
     id: str
@@ -25,6 +29,13 @@ class Challenge(BaseModel):
     answer: str
     metadata: Dict[str, str] | None = None
 
+    @model_serializer(mode="wrap")
+    def _hide_answer(self, handler):
+        data = handler(self)
+        if public_view.get():
+            data.pop("answer", None)
+        return data
+
 
 class Match(BaseModel):
     id: str
@@ -41,11 +52,13 @@ class Match(BaseModel):
     activeTheme: Optional[Theme] = None
     usedChallengeIds: List[str] = Field(default_factory=list)
     disabledThemes: List[Theme] = Field(default_factory=list)
+    deadline: Optional[int] = None  # Epoch ms when the current challenge times out
 
 
 class Settings(BaseModel):
     timers: Dict[Theme, int]
     scoring: Dict[str, int]
+    enforceTimers: bool = False  # Server auto-submits "timeout" when a challenge expires (opt-in until the UI follows `deadline`)
 
 
 class TournamentState(BaseModel):
@@ -54,3 +67,11 @@ class TournamentState(BaseModel):
     settings: Settings
     currentMatchId: Optional[str] = None
     globalUsedChallengeIds: List[str] = Field(default_factory=list)  # Track used challenges across all matches
+
+
+class JudgeResult(BaseModel):
+    correct: bool
+    challengeId: str
+    matched: Optional[str] = None  # accepted alias the guess resolved to
+    distance: Optional[int] = None  # edit distance to that alias (0 = exact)
+    scored: bool = False  # whether the verdict was applied to the match score
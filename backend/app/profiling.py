@@ -0,0 +1,242 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import ContextManager, Deque, Dict, Iterator, List, Optional, Set
+
+from pydantic import BaseModel, Field
+
+PROFILE_HEADER = "x-profile"
+MAX_STACK_DEPTH = 64
+# Captured traces are kept per bucket, so a slow phone's send bursts can't evict request profiles
+BUCKETS = ("requests", "sends")
+
+
+class ProfileSettings(BaseModel):
+    sampleAll: bool = False  # sample every request, not only those sent with an X-Profile header
+    # Capture any request slower than this; 0 = off. The env default is validated like any other value
+    slowMs: float = Field(os.environ.get("PROFILE_SLOW_MS") or 0, ge=0, validate_default=True)
+    intervalMs: float = Field(5.0, gt=0)  # stack sampling interval
+    keep: int = Field(50, ge=1)  # captured profiles retained
+
+
+class Trace:
+    """Timing breakdown (and optional stack samples) for one request or background job."""
+
+    def __init__(self, name: str, sampling: bool, bucket: str = "requests"):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.sampling = sampling
+        self.bucket = bucket
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status: Optional[int] = None
+        self.sections: Dict[str, List[float]] = {}
+        self.samples: Counter = Counter()
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.sections.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds * 1000
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "bucket": self.bucket,
+            "startedAt": self.started_at,
+            "durationMs": self.duration_ms,
+            "status": self.status,
+            "sampled": self.sampling,
+            "samples": sum(self.samples.values()),
+        }
+
+    def detail(self) -> dict:
+        return {
+            **self.summary(),
+            "sections": {name: {"count": count, "ms": round(ms, 3)} for name, (count, ms) in self.sections.items()},
+            "stacks": [{"stack": stack, "count": count} for stack, count in self.samples.most_common()],
+        }
+
+    def folded(self) -> str:
+        # Brendan Gregg's folded-stack format, ready for flamegraph.pl / speedscope
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def section(name: str) -> Iterator[None]:
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+def traced(profiler: Optional["Profiler"], name: str, bucket: str = "requests") -> ContextManager[Optional[Trace]]:
+    """Run work that no HTTP request is waiting on (WebSocket commands, timer expiry,
+    socket sends) under its own Trace, so slow capture sees it too. Nothing is
+    allocated unless ``sampleAll`` or ``slowMs`` is on."""
+    if profiler is None or not profiler.enabled:
+        return _NO_TRACE
+    return _traced(profiler, name, bucket)
+
+
+_NO_TRACE = nullcontext()
+
+
+@contextmanager
+def _traced(profiler: "Profiler", name: str, bucket: str) -> Iterator[Trace]:
+    trace = profiler.begin(name, requested=False, bucket=bucket)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        profiler.finish(trace, None)
+
+
+def fold_stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Opt-in request profiling.
+
+    While profiling is on (``sampleAll`` or ``slowMs``), or for a request sent with an
+    X-Profile header, each request gets a cheap Trace of named sections (persist, encode,
+    command, queue, broadcast, send); so do WebSocket commands, timer expiries, buzzer
+    verdicts and socket send bursts, via ``traced``. A background thread samples the
+    event loop's stack while a request is profiled and, once slow capture is on, for any
+    in-flight request that has run past ``slowMs``. Profiled and slow traces are kept in
+    a bounded buffer per bucket (``requests``, ``sends``) for listing and download.
+    """
+
+    def __init__(self, settings: Optional[ProfileSettings] = None):
+        self.settings = settings or ProfileSettings()
+        self.captured: Dict[str, Deque[Trace]] = {bucket: deque(maxlen=self.settings.keep) for bucket in BUCKETS}
+        self.lock = threading.Lock()
+        self._active: Set[Trace] = set()
+        self._loop_thread: Optional[int] = None
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, **changes) -> ProfileSettings:
+        # Validate and rebuild everything before applying, so a bad value changes nothing
+        settings = ProfileSettings.model_validate({**self.settings.model_dump(), **{k: v for k, v in changes.items() if v is not None}})
+        with self.lock:
+            if settings.keep != self.settings.keep:
+                self.captured = {bucket: deque(traces, maxlen=settings.keep) for bucket, traces in self.captured.items()}
+            self.settings = settings
+        return settings
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.sampleAll or bool(self.settings.slowMs)
+
+    def begin(self, name: str, requested: bool, bucket: str = "requests") -> Trace:
+        trace = Trace(name, sampling=requested or self.settings.sampleAll, bucket=bucket)
+        if trace.sampling or self.settings.slowMs:
+            self._loop_thread = threading.get_ident()
+            with self.lock:
+                self._active.add(trace)
+            self._ensure_sampler()
+            self._wake.set()
+        return trace
+
+    def finish(self, trace: Trace, status: Optional[int]) -> bool:
+        trace.duration_ms = (time.perf_counter() - trace.start) * 1000
+        trace.status = status
+        slow = bool(self.settings.slowMs) and trace.duration_ms >= self.settings.slowMs
+        with self.lock:
+            self._active.discard(trace)
+            if trace.sampling or slow:
+                self.captured[trace.bucket].append(trace)
+                return True
+        return False
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self.lock:
+            return next((t for traces in self.captured.values() for t in traces if t.id == trace_id), None)
+
+    def list(self, bucket: str = "requests") -> List[dict]:
+        with self.lock:
+            return [t.summary() for t in reversed(self.captured.get(bucket, ()))]
+
+    def _ensure_sampler(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self.lock:
+                idle = not self._active
+                if idle:
+                    self._wake.clear()
+            if idle:
+                self._wake.wait()
+                continue
+            time.sleep(self.settings.intervalMs / 1000)
+            now = time.perf_counter()
+            slow_after = self.settings.slowMs / 1000
+            with self.lock:
+                targets = [t for t in self._active if t.sampling or (slow_after and now - t.start >= slow_after)]
+                if not targets:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                stack = fold_stack(frame)
+                for trace in targets:
+                    trace.samples[stack] += 1
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that wraps each HTTP request in a Trace while profiling is on."""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        requested = headers.get(PROFILE_HEADER.encode(), b"").lower() in (b"1", b"true", b"yes")
+        if not requested and not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        trace = self.profiler.begin(f"{scope['method']} {scope['path']}", requested)
+        token = current_trace.set(trace)
+        status: List[int] = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+                if trace.sampling:
+                    message["headers"] = [*message.get("headers", []), (b"x-profile-id", trace.id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_trace.reset(token)
+            self.profiler.finish(trace, status[0] if status else None)
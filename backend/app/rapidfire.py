@@ -0,0 +1,175 @@
+import asyncio
+import time
+import uuid
+import weakref
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from .actor import TournamentActor
+from .encoding import dumps
+from .profiling import Profiler, traced
+from .state import GameState
+
+# Latency credit is capped so a client can't win by delaying its pongs; the arbitration
+# window matches the cap, so every buzz that could still win has arrived when it closes.
+MAX_COMPENSATION_MS = 150.0
+LATENCY_SMOOTHING = 0.2
+# Unanswered pings remembered per connection; older ones are forgotten
+MAX_PENDING_PINGS = 8
+
+
+def monotonic_ms() -> float:
+    return time.monotonic() * 1000
+
+
+class BuzzRound:
+    def __init__(self, match_id: str, challenge_id: str, locked_out: Iterable[str] = ()):
+        self.id = uuid.uuid4().hex[:8]
+        self.match_id = match_id
+        self.challenge_id = challenge_id
+        self.locked_out: Set[str] = set(locked_out)
+        # team -> (compensated time, receive time, player)
+        self.buzzes: Dict[str, Tuple[float, float, Optional[str]]] = {}
+        self.winner: Optional[str] = None
+        self.decided = False
+
+
+class BuzzerArbiter:
+    """First-buzz arbitration for rapid-fire rounds, driven entirely over the WebSocket.
+
+    A connection claims its team with ``buzz:join`` and can only buzz for that team.
+    Buzzes are stamped with the server's monotonic receive time minus the sender's
+    measured one-way latency (half its smoothed ping RTT, timed from send times kept
+    server-side per connection and matched by nonce). The first buzz opens a short
+    window; when it closes the earliest compensated buzz wins and everyone else is
+    locked out. Handling a buzz is a few dict operations, so only the verdict goes
+    through the tournament's command queue.
+    """
+
+    def __init__(self, game: GameState, actor: TournamentActor, profiler: Optional[Profiler] = None):
+        self.game = game
+        self.actor = actor
+        self.profiler = profiler
+        self.rounds: Dict[str, BuzzRound] = {}
+        self.latency: "weakref.WeakKeyDictionary[WebSocket, float]" = weakref.WeakKeyDictionary()
+        self.pings: "weakref.WeakKeyDictionary[WebSocket, Dict[str, float]]" = weakref.WeakKeyDictionary()
+        self.teams: "weakref.WeakKeyDictionary[WebSocket, Dict[str, str]]" = weakref.WeakKeyDictionary()  # match id -> team
+        self._deciding: Set[asyncio.Task] = set()
+
+    def open(self, match_id: str, challenge_id: str, locked_out: Iterable[str] = ()) -> BuzzRound:
+        round_ = BuzzRound(match_id, challenge_id, locked_out)
+        self.rounds[match_id] = round_
+        return round_
+
+    def close(self, match_id: str) -> Optional[BuzzRound]:
+        return self.rounds.pop(match_id, None)
+
+    def current(self, match_id: str) -> Optional[BuzzRound]:
+        round_ = self.rounds.get(match_id)
+        if round_ is None:
+            return None
+        # The challenge moved on (timeout, manual submit): the round is stale
+        match = self.game.get_match(match_id)
+        if not match.currentChallenge or match.currentChallenge.id != round_.challenge_id:
+            self.close(match_id)
+            return None
+        return round_
+
+    async def ping(self, match_id: str) -> None:
+        manager = self.actor.manager
+        for websocket in manager.audience(f"match:{match_id}"):
+            nonce = uuid.uuid4().hex[:12]
+            pending = self.pings.setdefault(websocket, {})
+            if len(pending) >= MAX_PENDING_PINGS:
+                del pending[next(iter(pending))]
+            pending[nonce] = monotonic_ms()
+            manager.send(websocket, dumps({"type": "buzz:ping", "matchId": match_id, "nonce": nonce}).decode())
+
+    async def handle_pong(self, websocket: WebSocket, message: dict) -> None:
+        # Only our own record of when the ping went out counts; the client just echoes the nonce
+        nonce = message.get("nonce")
+        sent = self.pings.get(websocket, {}).pop(nonce, None) if isinstance(nonce, str) else None
+        if sent is None:
+            return
+        rtt = monotonic_ms() - sent
+        previous = self.latency.get(websocket)
+        sample = rtt / 2
+        self.latency[websocket] = sample if previous is None else previous + LATENCY_SMOOTHING * (sample - previous)
+
+    def team_of(self, websocket: WebSocket, match_id: str) -> Optional[str]:
+        return self.teams.get(websocket, {}).get(match_id)
+
+    async def handle_join(self, websocket: WebSocket, message: dict) -> None:
+        match_id = message.get("matchId")
+        team = message.get("team")
+        reply = {"type": "buzz:joined", "matchId": match_id, "team": team}
+        teams = self.teams.setdefault(websocket, {})
+        if not isinstance(match_id, str) or team not in ("A", "B"):
+            reason = "matchId and team ('A' or 'B') are required"
+        elif teams.get(match_id, team) != team:
+            reason = f"already buzzing for team {teams[match_id]}"
+        else:
+            reason = None
+        if reason:
+            self.actor.manager.reply(websocket, {**reply, "accepted": False, "reason": reason})
+            return
+        teams[match_id] = team
+        self.actor.manager.reply(websocket, {**reply, "accepted": True})
+
+    async def handle_buzz(self, websocket: WebSocket, message: dict) -> None:
+        received = monotonic_ms()
+        match_id = message.get("matchId")
+        team = self.team_of(websocket, match_id) if isinstance(match_id, str) else None
+        reply = {"type": "buzz:ack", "matchId": match_id, "team": team}
+        round_ = self.current(match_id) if isinstance(match_id, str) else None
+        if round_ is None or message.get("roundId") not in (None, round_.id):
+            reason = "no open round"
+        elif team is None:
+            reason = "send buzz:join with your team first"
+        elif round_.decided:
+            reason = "locked"
+        elif team in round_.locked_out:
+            reason = "locked out"
+        else:
+            reason = None
+        if reason:
+            self.actor.manager.reply(websocket, {**reply, "accepted": False, "reason": reason})
+            return
+
+        compensated = received - min(self.latency.get(websocket, 0.0), MAX_COMPENSATION_MS)
+        previous = round_.buzzes.get(team)
+        if previous is None or compensated < previous[0]:
+            round_.buzzes[team] = (compensated, received, message.get("player"))
+        if len(round_.buzzes) == 1 and previous is None:
+            asyncio.get_running_loop().call_later(MAX_COMPENSATION_MS / 1000, self._schedule_decision, round_)
+        self.actor.manager.reply(websocket, {**reply, "accepted": True, "roundId": round_.id})
+
+    def _schedule_decision(self, round_: BuzzRound) -> None:
+        round_.decided = True
+        task = asyncio.create_task(self._decide(round_))
+        self._deciding.add(task)
+        task.add_done_callback(self._deciding.discard)
+
+    async def _decide(self, round_: BuzzRound) -> None:
+        ranked = sorted(round_.buzzes.items(), key=lambda item: item[1][0])
+        team, (compensated, _, player) = ranked[0]
+        margin = ranked[1][1][0] - compensated if len(ranked) > 1 else None
+
+        def command():
+            if self.rounds.get(round_.match_id) is not round_:
+                return None, []
+            round_.winner = team
+            return None, [{
+                "type": "buzz:winner",
+                "topic": f"match:{round_.match_id}",
+                "matchId": round_.match_id,
+                "roundId": round_.id,
+                "team": team,
+                "player": player,
+                "marginMs": round(margin, 1) if margin is not None else None,
+            }]
+
+        # Runs after the buzz that opened the window has been answered, so it gets its own trace
+        with traced(self.profiler, "BUZZ decide"):
+            await self.actor.execute(command)
@@ -1,12 +1,21 @@
 import uuid
-from typing import List, Optional
-
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-
-from .models import Settings, Team, TournamentState, Theme
+import weakref
+from typing import Dict, List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, WebSocket
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from .actor import Command, Event, TournamentActor
+from .encoding import JSONBytesResponse, dumps
+from .models import JudgeResult, Match, Settings, Team, TournamentState, Theme
+from .profiling import Profiler, traced
+from .rapidfire import BuzzerArbiter
 from .state import GameState
-from .ws import ConnectionManager
+from .timers import now_ms
+
+# Guesses a team-bound phone may send per challenge; host connections are not limited
+MAX_GUESSES = 3
 
 
 class TeamInput(BaseModel):
@@ -37,12 +46,14 @@ class SubmitChallengeRequest(BaseModel):
     matchId: str
     team: str  # "A" or "B"
     result: str  # correct|wrong|timeout
+    challengeId: Optional[str] = None  # reject if this challenge was already resolved
 
 
 class SubmitRoundRequest(BaseModel):
     matchId: str
     teamA: str  # correct|wrong|timeout
     teamB: str  # correct|wrong|timeout
+    challengeId: Optional[str] = None  # reject if this challenge was already resolved
 
 
 class NextChallengeRequest(BaseModel):
@@ -69,6 +80,28 @@ class ResetRoundRequest(BaseModel):
     matchId: str
 
 
+class JudgeRequest(BaseModel):
+    matchId: str
+    guess: str
+    team: Optional[Literal["A", "B"]] = None  # a correct guess is scored for this team
+
+
+class RapidFireStartRequest(BaseModel):
+    matchId: str
+
+
+class RapidFireResolveRequest(BaseModel):
+    matchId: str
+    result: Literal["correct", "wrong"]  # for the team that won the buzz
+
+
+class ProfileSettingsRequest(BaseModel):
+    sampleAll: Optional[bool] = None
+    slowMs: Optional[float] = Field(None, ge=0)
+    intervalMs: Optional[float] = Field(None, gt=0)
+    keep: Optional[int] = Field(None, ge=1)
+
+
 class SfxRequest(BaseModel):
     event: str
 
@@ -77,117 +110,315 @@ class ResetMatchRequest(BaseModel):
     matchId: str
 
 
-def create_router(game: GameState, manager: ConnectionManager) -> APIRouter:
+def create_router(game: GameState, actor: TournamentActor, profiler: Optional[Profiler] = None) -> APIRouter:
     router = APIRouter()
 
-    async def broadcast_state():
-        await manager.broadcast({"type": "state:update", "data": game.get_state().model_dump()})
+    last_leaderboard = b""
+
+    # Events may hold live models: the actor encodes them as soon as the command returns
+    def state_events() -> List[Event]:
+        nonlocal last_leaderboard
+        state = game.get_state()
+        # Phones get the tournament copy without answers; the host UI follows the "host" copy instead
+        events: List[Event] = [
+            {"type": "state:update", "topic": "tournament", "data": state},
+            {"type": "state:update", "topic": "host", "data": state},
+        ]
+        leaderboard = dumps(state.leaderboard)
+        if leaderboard != last_leaderboard:
+            last_leaderboard = leaderboard
+            events.append({"type": "leaderboard:update", "topic": "leaderboard", "leaderboard": state.leaderboard})
+        return events
+
+    def timer_fields(match: Match) -> dict:
+        return {"deadline": match.deadline, "serverTime": now_ms()}
+
+    def result_events(match: Match) -> List[Event]:
+        events = [{"type": "score:update", "topic": f"match:{match.id}", "matchId": match.id, "score": match.score, "challenge": match.currentChallenge, **timer_fields(match)}]
+        if match.status == "completed":
+            events.append({"type": "match:advance", "topic": f"match:{match.id}", "matchId": match.id, "winnerId": match.winnerId, "loserId": match.loserId})
+        events.extend(state_events())
+        return events
+
+    async def expire_challenge(match_id: str, challenge_id: str):
+        def command():
+            match = game.submit_round(match_id, "timeout", "timeout", challenge_id=challenge_id)
+            return None, [
+                {"type": "timer:expired", "topic": "host", "matchId": match_id, "challengeId": challenge_id},
+                {"type": "sfx", "topic": "sfx", "event": "timeout"},
+                *result_events(match),
+            ]
+
+        with traced(profiler, "TIMER expire"):
+            try:
+                await actor.execute(command)
+            except ValueError:
+                pass
+
+    if game.timers:
+        game.timers.on_expire = expire_challenge
+
+    buzzers = BuzzerArbiter(game, actor, profiler)
+    actor.manager.on("buzz:join", buzzers.handle_join)
+    actor.manager.on("buzz", buzzers.handle_buzz)
+    actor.manager.on("buzz:pong", buzzers.handle_pong)
+
+    async def judge_guess(payload: JudgeRequest) -> JudgeResult:
+        # Judging is read-only and runs outside the queue; only scoring is serialized,
+        # guarded by the challenge id in case another guess or a timeout got there first
+        verdict = game.judge(payload.matchId, payload.guess)
+
+        def command():
+            events: List[Event] = []
+            match = game.get_match(payload.matchId)
+            # Only a guess that lost the race to another result (or a timeout) goes unscored
+            still_open = match.status == "in_progress" and match.currentChallenge and match.currentChallenge.id == verdict.challengeId
+            # While the buzzers are open only the team that won the buzz may answer
+            round_ = buzzers.current(payload.matchId)
+            if payload.team and verdict.correct and still_open and (round_ is None or round_.winner == payload.team):
+                if round_ is not None:
+                    buzzers.close(match.id)
+                match = game.submit_challenge(payload.matchId, payload.team, "correct", verdict.challengeId)
+                verdict.scored = True
+                events = result_events(match)
+            report = {"type": "judge:result", "topic": "host", "matchId": payload.matchId, "team": payload.team, "guess": payload.guess, **verdict.model_dump()}
+            return verdict, [report, *events]
+
+        return await actor.execute(command)
+
+    # socket -> match id -> (challenge id, guesses sent)
+    guesses: "weakref.WeakKeyDictionary[WebSocket, Dict[str, Tuple[str, int]]]" = weakref.WeakKeyDictionary()
+
+    def check_guesser(websocket: WebSocket, payload: JudgeRequest) -> None:
+        # Host connections may score for either team; a phone only for the team it joined
+        # with buzz:join, and only a few times per challenge so fuzzy matching can't be brute-forced
+        if not payload.team or actor.manager.is_host(websocket):
+            return
+        if buzzers.team_of(websocket, payload.matchId) != payload.team:
+            raise ValueError(f"This connection can't answer for team {payload.team}; send buzz:join first")
+        match = game.get_match(payload.matchId)
+        challenge_id = match.currentChallenge.id if match.currentChallenge else ""
+        seen, count = guesses.setdefault(websocket, {}).get(payload.matchId, (challenge_id, 0))
+        count = count + 1 if seen == challenge_id else 1
+        if count > MAX_GUESSES:
+            raise ValueError(f"Only {MAX_GUESSES} guesses per challenge")
+        guesses[websocket][payload.matchId] = (challenge_id, count)
+
+    async def ws_judge(websocket: WebSocket, message: dict):
+        try:
+            payload = JudgeRequest.model_validate(message)
+            check_guesser(websocket, payload)
+            verdict = await judge_guess(payload)
+        except Exception as exc:
+            actor.manager.reply(websocket, {"type": "judge:error", "detail": str(exc)})
+            return
+        actor.manager.reply(websocket, {"type": "judge:result", "matchId": message.get("matchId"), **verdict.model_dump()})
+
+    actor.manager.on("judge", ws_judge)
+
+    def buzz_open_event(match: Match, round_) -> Event:
+        return {
+            "type": "buzz:open",
+            "topic": f"match:{match.id}",
+            "matchId": match.id,
+            "roundId": round_.id,
+            "challenge": match.currentChallenge,
+            "lockedOut": sorted(round_.locked_out),
+            **timer_fields(match),
+        }
+
+    async def respond(command: Command) -> JSONBytesResponse:
+        # Encode the result inside the command so the response matches the state it produced
+        def encoded():
+            result, events = command()
+            return dumps(result), events
+
+        return JSONBytesResponse(await actor.execute(encoded))
 
     @router.get("/state", response_model=TournamentState)
     async def get_state():
-        return game.get_state()
+        return JSONBytesResponse(dumps(game.get_state()))
 
     @router.post("/reset", response_model=TournamentState)
     async def reset(payload: ResetRequest):
         teams = [t.to_team() for t in payload.teams] if payload.teams else None
-        state = game.reset(teams=teams, settings=payload.settings)
-        await broadcast_state()
-        return state
+
+        def command():
+            state = game.reset(teams=teams, settings=payload.settings)
+            return state, state_events()
+
+        return await respond(command)
 
     @router.post("/teams", response_model=TournamentState)
     async def set_teams(payload: List[TeamInput]):
         teams = [t.to_team() for t in payload]
-        state = game.set_teams(teams)
-        await broadcast_state()
-        return state
+
+        def command():
+            state = game.set_teams(teams)
+            return state, state_events()
+
+        return await respond(command)
 
     @router.post("/start-match")
     async def start_match(payload: StartMatchRequest):
-        try:
+        def command():
             match = game.start_match(payload.matchId)
+            return match, [
+                {"type": "match:start", "topic": f"match:{match.id}", "matchId": match.id, "challenge": match.currentChallenge, **timer_fields(match)},
+                *state_events(),
+            ]
+
+        try:
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await manager.broadcast({"type": "match:start", "matchId": match.id, "challenge": match.currentChallenge.model_dump() if match.currentChallenge else None})
-        await broadcast_state()
-        return match
 
     @router.post("/theme")
     async def set_theme(payload: ThemeRequest):
-        try:
+        def command():
             challenge = game.set_theme(payload.matchId, payload.theme, payload.disabled)
+            match = game.get_match(payload.matchId)
+            return challenge, [
+                {"type": "challenge:new", "topic": f"match:{payload.matchId}", "matchId": payload.matchId, "challenge": challenge, **timer_fields(match)},
+                *state_events(),
+            ]
+
+        try:
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await manager.broadcast({"type": "challenge:new", "matchId": payload.matchId, "challenge": challenge.model_dump()})
-        await broadcast_state()
-        return challenge
 
     @router.post("/submit-challenge")
     async def submit_challenge(payload: SubmitChallengeRequest):
+        def command():
+            match = game.submit_challenge(payload.matchId, payload.team, payload.result, payload.challengeId)
+            return match, result_events(match)
+
         try:
-            match = game.submit_challenge(payload.matchId, payload.team, payload.result)
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await manager.broadcast({"type": "score:update", "matchId": match.id, "score": match.score.model_dump(), "challenge": match.currentChallenge.model_dump() if match.currentChallenge else None})
-        if match.status == "completed":
-            await manager.broadcast({"type": "match:advance", "matchId": match.id, "winnerId": match.winnerId, "loserId": match.loserId})
-        await broadcast_state()
-        return match
 
     @router.post("/submit-round")
     async def submit_round(payload: SubmitRoundRequest):
+        def command():
+            match = game.submit_round(payload.matchId, payload.teamA, payload.teamB, payload.challengeId)
+            return match, result_events(match)
+
         try:
-            match = game.submit_round(payload.matchId, payload.teamA, payload.teamB)
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await manager.broadcast({"type": "score:update", "matchId": match.id, "score": match.score.model_dump(), "challenge": match.currentChallenge.model_dump() if match.currentChallenge else None})
-        if match.status == "completed":
-            await manager.broadcast({"type": "match:advance", "matchId": match.id, "winnerId": match.winnerId, "loserId": match.loserId})
-        await broadcast_state()
-        return match
 
     @router.post("/next-challenge")
     async def next_challenge(payload: NextChallengeRequest):
-        try:
+        def command():
             match = game.next_challenge(payload.matchId)
+            return match, [
+                {"type": "challenge:new", "topic": f"match:{match.id}", "matchId": match.id, "challenge": match.currentChallenge, **timer_fields(match)},
+                *state_events(),
+            ]
+
+        try:
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await manager.broadcast({"type": "challenge:new", "matchId": match.id, "challenge": match.currentChallenge.model_dump() if match.currentChallenge else None})
-        await broadcast_state()
-        return match
 
     @router.post("/override-score", response_model=TournamentState)
     async def override_score(payload: OverrideScoreRequest):
-        state = game.override_score(payload.matchId, payload.teamAScore, payload.teamBScore, payload.leaderboardDelta)
-        await broadcast_state()
-        return state
+        def command():
+            state = game.override_score(payload.matchId, payload.teamAScore, payload.teamBScore, payload.leaderboardDelta)
+            return state, state_events()
+
+        return await respond(command)
 
     @router.post("/advance", response_model=TournamentState)
     async def advance(payload: AdvanceRequest):
-        try:
+        def command():
             state = game.advance_manual(payload.matchId, payload.winnerId)
+            return state, state_events()
+
+        try:
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await broadcast_state()
-        return state
 
     @router.post("/reset-match", response_model=TournamentState)
     async def reset_match(payload: ResetMatchRequest):
-        try:
+        def command():
             state = game.reset_match(payload.matchId)
+            return state, state_events()
+
+        try:
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await broadcast_state()
-        return state
 
     @router.post("/reset-round")
     async def reset_round(payload: ResetRoundRequest):
-        try:
+        def command():
             match = game.reset_round(payload.matchId)
+            return match, [
+                {"type": "challenge:new", "topic": f"match:{payload.matchId}", "matchId": payload.matchId, "challenge": None},
+                *state_events(),
+            ]
+
+        try:
+            return await respond(command)
+        except Exception as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    @router.post("/judge", response_model=JudgeResult)
+    async def judge(payload: JudgeRequest):
+        try:
+            return JSONBytesResponse(dumps(await judge_guess(payload)))
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await manager.broadcast({"type": "challenge:new", "matchId": payload.matchId, "challenge": None})
-        await broadcast_state()
-        return match
+
+    @router.post("/rapidfire/start")
+    async def rapidfire_start(payload: RapidFireStartRequest):
+        def command():
+            challenge = game.start_rapidfire(payload.matchId)
+            match = game.get_match(payload.matchId)
+            round_ = buzzers.open(match.id, challenge.id)
+            return challenge, [buzz_open_event(match, round_), *state_events()]
+
+        try:
+            response = await respond(command)
+        except Exception as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        await buzzers.ping(payload.matchId)
+        return response
+
+    @router.post("/rapidfire/resolve")
+    async def rapidfire_resolve(payload: RapidFireResolveRequest):
+        reopened = []
+
+        def command():
+            round_ = buzzers.current(payload.matchId)
+            if round_ is None or round_.winner is None:
+                raise ValueError("No buzz to resolve")
+            match = game.get_match(payload.matchId)
+            if payload.result == "correct":
+                buzzers.close(match.id)
+                match = game.submit_challenge(match.id, round_.winner, "correct", round_.challenge_id)
+                return match, result_events(match)
+            # A wrong answer locks that team out and reopens the buzzers for the rest
+            locked_out = round_.locked_out | {round_.winner}
+            if locked_out >= {"A", "B"}:
+                buzzers.close(match.id)
+                match = game.submit_round(match.id, "wrong", "wrong", round_.challenge_id)
+                return match, result_events(match)
+            reopened.append(buzzers.open(match.id, round_.challenge_id, locked_out))
+            return match, [buzz_open_event(match, reopened[0])]
+
+        try:
+            response = await respond(command)
+        except Exception as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        if reopened:
+            await buzzers.ping(payload.matchId)
+        return response
 
     @router.post("/export")
     async def export_state():
@@ -195,17 +426,47 @@ def create_router(game: GameState, manager: ConnectionManager) -> APIRouter:
 
     @router.post("/sfx")
     async def sfx(payload: SfxRequest):
-        await manager.broadcast({"type": "sfx", "event": payload.event})
-        return {"ok": True}
+        return await respond(lambda: ({"ok": True}, [{"type": "sfx", "topic": "sfx", "event": payload.event}]))
 
     @router.post("/reset-match")
     async def reset_match(payload: ResetMatchRequest):
-        try:
+        def command():
             match = game.reset_match(payload.matchId)
+            return match, [
+                {"type": "match:start", "topic": f"match:{match.id}", "matchId": match.id, "challenge": None},  # effectively resets view
+                *state_events(),
+            ]
+
+        try:
+            return await respond(command)
         except Exception as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-        await manager.broadcast({"type": "match:start", "matchId": match.id, "challenge": None}) # effectively resets view
-        await broadcast_state()
-        return match
+
+    return router
+
+
+def create_profiling_router(profiler: Profiler) -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/profiles")
+    async def list_profiles(bucket: Literal["requests", "sends"] = "requests"):
+        return {"settings": profiler.settings, "profiles": profiler.list(bucket)}
+
+    @router.post("/profiles/settings")
+    async def configure_profiling(payload: ProfileSettingsRequest):
+        return profiler.configure(**payload.model_dump())
+
+    @router.get("/profiles/{profile_id}")
+    async def get_profile(profile_id: str, format: str = "json"):
+        trace = profiler.get(profile_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+        with profiler.lock:
+            if format == "folded":
+                return PlainTextResponse(
+                    trace.folded(),
+                    headers={"Content-Disposition": f'attachment; filename="profile-{trace.id}.folded"'},
+                )
+            return trace.detail()
 
     return router
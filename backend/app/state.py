@@ -1,11 +1,13 @@
-import json
 import random
 import uuid
 from pathlib import Path
 from typing import Dict, List, Optional
 
-from .content_loader import load_all
-from .models import Challenge, Match, MatchScore, Settings, Team, Theme, TournamentState
+from .content_loader import load_all, load_rapidfire
+from .judge import AnswerIndex
+from .models import Challenge, JudgeResult, Match, MatchScore, Settings, Team, Theme, TournamentState
+from .profiling import section
+from .timers import RoundTimers, now_ms
 
 STATE_PATH = Path(__file__).resolve().parents[2] / "state" / "tournament.json"
 
@@ -51,13 +53,17 @@ def _make_match(match_id: str, label: str, teamA: Optional[Team], teamB: Optiona
 
 
 class GameState:
-    def __init__(self):
+    def __init__(self, timers: Optional[RoundTimers] = None):
         self.content: Dict[Theme, List[Challenge]] = load_all()
+        self.rapidfire: List[Challenge] = load_rapidfire()
+        self.answers = AnswerIndex([*(c for pool in self.content.values() for c in pool), *self.rapidfire])
+        self.timers = timers
         saved = self._load()
         if saved:
             self.state = saved
             self._normalize_bracket_labels()
             self._normalize_settings()
+            self._restore_timers()
         else:
             self.state = self._bootstrap(DEFAULT_TEAMS, DEFAULT_SETTINGS)
             self._persist()
@@ -66,15 +72,16 @@ class GameState:
     def _load(self) -> Optional[TournamentState]:
         if not STATE_PATH.exists():
             return None
-        data = json.loads(STATE_PATH.read_text())
+        # Our own snapshot: parse and build it in one pydantic-core pass, no intermediate dict tree
         try:
-            return TournamentState.model_validate(data)
+            return TournamentState.model_validate_json(STATE_PATH.read_bytes())
         except Exception:
             return None
 
     def _persist(self) -> None:
-        STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-        STATE_PATH.write_text(self.state.model_dump_json(indent=2))
+        with section("persist"):
+            STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            STATE_PATH.write_text(self.state.model_dump_json())
 
     def _normalize_bracket_labels(self) -> None:
         label_map = {
@@ -105,6 +112,29 @@ class GameState:
         if changed:
             self._persist()
 
+    def _restore_timers(self) -> None:
+        # Re-arm countdowns that were running when the snapshot was written
+        if not self.timers:
+            return
+        for match in self.state.bracket:
+            if match.status == "in_progress" and match.currentChallenge and match.deadline:
+                self.timers.schedule(match.id, (match.deadline - now_ms()) / 1000, match.currentChallenge.id)
+
+    # timer helpers
+    def _arm_timer(self, match: Match) -> None:
+        challenge = match.currentChallenge
+        seconds = self.state.settings.timers.get(challenge.theme) if challenge else None
+        if not self.timers or not self.state.settings.enforceTimers or not seconds:
+            self._disarm_timer(match)
+            return
+        match.deadline = now_ms() + seconds * 1000
+        self.timers.schedule(match.id, seconds, challenge.id)
+
+    def _disarm_timer(self, match: Match) -> None:
+        match.deadline = None
+        if self.timers:
+            self.timers.cancel(match.id)
+
     # setup helpers
     def _bootstrap(self, teams: List[Team], settings: Settings) -> TournamentState:
         if len(teams) < 8:
@@ -126,6 +156,8 @@ class GameState:
     def reset(self, teams: Optional[List[Team]] = None, settings: Optional[Settings] = None) -> TournamentState:
         new_settings = settings or self.state.settings or DEFAULT_SETTINGS
         new_teams = teams or _fresh_default_teams()
+        for match in self.state.bracket:
+            self._disarm_timer(match)
         self.state = self._bootstrap(new_teams, new_settings)
         self._persist()
         return self.state
@@ -205,8 +237,8 @@ class GameState:
             if match.teamB and match.teamB.id == team_id:
                 match.teamB.score = team.score
 
-    def _draw_challenge(self, match: Match, theme: Theme) -> Challenge:
-        pool = self.content.get(theme, [])
+    def _draw_challenge(self, match: Match, theme: Theme, pool: Optional[List[Challenge]] = None) -> Challenge:
+        pool = self.content.get(theme, []) if pool is None else pool
         # Exclude challenges used globally across all matches in the tournament
         global_used = set(self.state.globalUsedChallengeIds)
         available = [c for c in pool if c.id not in global_used]
@@ -219,6 +251,7 @@ class GameState:
         self.state.globalUsedChallengeIds.append(challenge.id)
         match.currentChallenge = challenge
         match.activeTheme = theme
+        self._arm_timer(match)
         return challenge
 
     def _pick_random_theme(self, match: Match, exclude: Optional[Theme] = None) -> Theme:
@@ -237,6 +270,7 @@ class GameState:
         match.loserId = None
         match.status = "pending"
         match.currentChallenge = None
+        self._disarm_timer(match)
         match.activeTheme = None
         match.usedChallengeIds = []
         match.score.teamA = 0
@@ -270,6 +304,7 @@ class GameState:
         if match.usedChallengeIds:
             match.usedChallengeIds.pop()
         match.currentChallenge = None
+        self._disarm_timer(match)
         self._persist()
         return match
 
@@ -277,6 +312,9 @@ class GameState:
     def get_state(self) -> TournamentState:
         return self.state
 
+    def get_match(self, match_id: str) -> Match:
+        return self._find_match(match_id)
+
     def set_teams(self, teams: List[Team]) -> TournamentState:
         if len(teams) < 8:
             raise ValueError("Need at least 8 teams")
@@ -317,10 +355,34 @@ class GameState:
         self._persist()
         return challenge
 
-    def submit_challenge(self, match_id: str, team_side: str, result: str) -> Match:
+    def judge(self, match_id: str, guess: str) -> JudgeResult:
+        match = self._find_match(match_id)
+        if match.status != "in_progress" or not match.currentChallenge:
+            raise ValueError("No active challenge")
+        return self.answers.judge(match.currentChallenge, guess)
+
+    def start_rapidfire(self, match_id: str) -> Challenge:
+        match = self._find_match(match_id)
+        if match.status != "in_progress":
+            raise ValueError("Match not in progress")
+        if not self.rapidfire:
+            raise ValueError("No rapid-fire challenges available")
+        challenge = self._draw_challenge(match, self.rapidfire[0].theme, pool=self.rapidfire)
+        # Buzzers and /rapidfire/resolve close a rapid-fire question, not the trivia countdown
+        self._disarm_timer(match)
+        self._persist()
+        return challenge
+
+    def _check_challenge(self, match: Match, challenge_id: Optional[str]) -> None:
+        # Reject results aimed at a challenge that has already been resolved (e.g. by a timeout)
+        if challenge_id is not None and (not match.currentChallenge or match.currentChallenge.id != challenge_id):
+            raise ValueError("Challenge already resolved")
+
+    def submit_challenge(self, match_id: str, team_side: str, result: str, challenge_id: Optional[str] = None) -> Match:
         match = self._find_match(match_id)
         if match.status != "in_progress":
             raise ValueError("Match not in progress")
+        self._check_challenge(match, challenge_id)
         if team_side not in ("A", "B"):
             raise ValueError("team must be 'A' or 'B'")
 
@@ -344,10 +406,11 @@ class GameState:
         self._persist()
         return match
 
-    def submit_round(self, match_id: str, result_a: str, result_b: str) -> Match:
+    def submit_round(self, match_id: str, result_a: str, result_b: str, challenge_id: Optional[str] = None) -> Match:
         match = self._find_match(match_id)
         if match.status != "in_progress":
             raise ValueError("Match not in progress")
+        self._check_challenge(match, challenge_id)
 
         match.score.currentChallenge += 1
         if result_a == "correct":
@@ -390,6 +453,7 @@ class GameState:
         self._advance(match)
         self.state.currentMatchId = None
         match.currentChallenge = None
+        self._disarm_timer(match)
 
     def _check_winner(self, score: MatchScore) -> Optional[str]:
         """Only finish once the scheduled number of rounds have been played."""
@@ -429,6 +493,7 @@ class GameState:
         match.winnerId = winner_id
         match.loserId = match.teamB.id if match.teamA.id == winner_id else match.teamA.id
         match.status = "completed"
+        self._disarm_timer(match)
         self._update_leaderboard_score(winner_id, self.state.settings.scoring.get("winBonus", 2))
         self._advance(match)
         self._persist()
@@ -442,6 +507,7 @@ class GameState:
         match.score = MatchScore(bestOf=match.score.bestOf)
         match.status = "pending"
         match.currentChallenge = None
+        self._disarm_timer(match)
         match.winnerId = None
         match.loserId = None
         # Note: We do not clear usedChallengeIds to avoid repeats if possible, 
@@ -0,0 +1,90 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+ExpiryHandler = Callable[[str, str], Awaitable[None]]
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class RoundTimers:
+    """Process-wide deadline scheduler for challenge countdowns.
+
+    A single asyncio task sleeps until the earliest deadline in a heap, so the
+    cost of a running match is one heap entry rather than one task. Deadlines are
+    fixed on the loop's monotonic clock when scheduled, which keeps expiries from
+    drifting however long a countdown has been waiting.
+    """
+
+    def __init__(self, on_expire: Optional[ExpiryHandler] = None):
+        self.on_expire = on_expire
+        self._heap: List[Tuple[float, int, str, str]] = []
+        self._live: Dict[str, Tuple[float, str]] = {}
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def _clock(self) -> float:
+        return time.monotonic()
+
+    def schedule(self, key: str, delay: float, token: str) -> None:
+        """Arm (or re-arm) the countdown for ``key``; ``token`` identifies the challenge."""
+        when = self._clock() + max(0.0, delay)
+        self._live[key] = (when, token)
+        heapq.heappush(self._heap, (when, next(self._counter), key, token))
+        self._compact()
+        if self._wakeup and self._heap[0][0] == when:
+            self._wakeup.set()
+
+    def cancel(self, key: str) -> None:
+        # Heap entries are dropped lazily when they surface or on compaction.
+        self._live.pop(key, None)
+
+    def _compact(self) -> None:
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._live):
+            self._heap = [e for e in self._heap if self._live.get(e[2]) == (e[0], e[3])]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> List[Tuple[str, str]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, key, token = heapq.heappop(self._heap)
+            if self._live.get(key) == (when, token):
+                del self._live[key]
+                due.append((key, token))
+        return due
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            self._wakeup.clear()
+            for key, token in self._pop_due(self._clock()):
+                if self.on_expire:
+                    task = asyncio.create_task(self.on_expire(key, token))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+            timeout = self._heap[0][0] - self._clock() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
@@ -1,25 +1,184 @@
-from typing import List
+import asyncio
+import os
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Union
 from fastapi import WebSocket, WebSocketDisconnect
 
+from .encoding import dumps
+from .profiling import Profiler, section, traced
+
+# Topics: "tournament" (state:update), "match:<id>" (match events; "match" covers every match),
+# "leaderboard", "sfx" and "host" (host-only notices: guesses, answers, timeouts)
+DEFAULT_TOPICS = ("tournament", "match", "leaderboard", "sfx")
+# Never subscribed by default; when HOST_TOKEN is set, subscribing also requires that token
+HOST_TOPICS = ("host",)
+
+MessageHandler = Callable[[WebSocket, dict], Awaitable[None]]
+
+# Frames a socket may fall behind by before it is dropped (it can resume on reconnect)
+MAX_PENDING_FRAMES = 1024
+# "Try again later": the client reconnects with since/epoch and catches up
+DROP_CLOSE_CODE = 1013
+
+
+def topic_list(value) -> Optional[List[str]]:
+    if isinstance(value, list) and all(isinstance(topic, str) for topic in value):
+        return value
+    return None
+
+
+def topic_matches(subscribed: Iterable[str], topic: Optional[str]) -> bool:
+    if topic is None:
+        return True
+    subscribed = set(subscribed)
+    return topic in subscribed or topic.partition(":")[0] in subscribed
+
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, profiler: Optional[Profiler] = None):
         self.active: List[WebSocket] = []
+        self.topics: Dict[WebSocket, Set[str]] = {}
+        self.subscribers: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.handlers: Dict[str, MessageHandler] = {}
+        # Each socket drains its own queue, so one slow phone never holds up the others
+        self.outboxes: Dict[WebSocket, asyncio.Queue] = {}
+        self.senders: Dict[WebSocket, asyncio.Task] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self.host_token: Optional[str] = os.environ.get("HOST_TOKEN") or None
+        self.profiler = profiler
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active.append(websocket)
+        self.add(websocket)
+
+    def add(self, websocket: WebSocket, topics: Iterable[str] = DEFAULT_TOPICS, backlog: Iterable[str] = ()):
+        """Register a socket; ``backlog`` frames are queued ahead of any live broadcast."""
+        if websocket not in self.topics:
+            self.active.append(websocket)
+            self.topics[websocket] = set()
+            self.outboxes[websocket] = asyncio.Queue()
+            self.senders[websocket] = asyncio.create_task(self._drain(websocket))
+        for text in backlog:
+            self.outboxes[websocket].put_nowait(text)
+        self.subscribe(websocket, topics)
+
+    async def _drain(self, websocket: WebSocket):
+        outbox = self.outboxes[websocket]
+        while True:
+            text = await outbox.get()
+            # One trace per burst of queued frames rather than per frame
+            with traced(self.profiler, "WS send", bucket="sends"):
+                while True:
+                    try:
+                        with section("send"):
+                            await websocket.send_text(text)
+                    except Exception:
+                        self.drop(websocket)
+                        return
+                    if outbox.empty():
+                        break
+                    text = outbox.get_nowait()
+
+    def send(self, websocket: WebSocket, text: str):
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            return
+        if outbox.qsize() >= MAX_PENDING_FRAMES:
+            self.drop(websocket)
+            return
+        outbox.put_nowait(text)
+
+    def drop(self, websocket: WebSocket):
+        """Unregister a socket that fell behind or failed a send, and close it so the client reconnects."""
+        self.disconnect(websocket)
+        task = asyncio.create_task(self._close(websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=DROP_CLOSE_CODE)
+        except Exception:
+            pass  # already gone
+
+    def reply(self, websocket: WebSocket, message: dict):
+        # Direct replies share the socket's outbox, so they never race the drain task's sends
+        self.send(websocket, dumps(message, public=True).decode())
+
+    def permitted(self, topics: Iterable[str], token: Optional[str] = None) -> List[str]:
+        """Drop host-only topics unless the host token (if one is configured) matches."""
+        allowed = self.host_token is None or token == self.host_token
+        return [topic for topic in topics if allowed or topic not in HOST_TOPICS]
+
+    def is_host(self, websocket: WebSocket) -> bool:
+        # Only permitted() sockets (holding the host token, if one is set) can be on "host"
+        return "host" in self.topics.get(websocket, ())
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        if websocket not in self.topics:
+            return
+        for topic in topics:
+            self.topics[websocket].add(topic)
+            self.subscribers[topic].add(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        for topic in topics:
+            self.topics.get(websocket, set()).discard(topic)
+            subscribers = self.subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self.subscribers[topic]
+
+    def on(self, message_type: str, handler: MessageHandler):
+        self.handlers[message_type] = handler
+
+    async def dispatch(self, websocket: WebSocket, message: dict):
+        kind = message.get("type")
+        # A list or dict "type" would make the handler lookup raise and tear down the socket
+        if not isinstance(kind, str):
+            return
+        if kind in ("subscribe", "unsubscribe") or kind in self.handlers:
+            with traced(self.profiler, f"WS {kind}"):
+                await self._handle(websocket, kind, message)
+
+    async def _handle(self, websocket: WebSocket, kind: str, message: dict):
+        if kind in ("subscribe", "unsubscribe"):
+            topics = topic_list(message.get("topics", []))
+            if topics is None:
+                self.reply(websocket, {"type": f"{kind}:error", "detail": "topics must be a list of strings"})
+            elif kind == "subscribe":
+                self.subscribe(websocket, self.permitted(topics, message.get("hostToken")))
+            else:
+                self.unsubscribe(websocket, topics)
+        elif kind in self.handlers:
+            await self.handlers[kind](websocket, message)
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active:
             self.active.remove(websocket)
+        self.unsubscribe(websocket, list(self.topics.get(websocket, ())))
+        self.topics.pop(websocket, None)
+        self.outboxes.pop(websocket, None)
+        sender = self.senders.pop(websocket, None)
+        if sender is not None and sender is not asyncio.current_task():
+            sender.cancel()
+
+    def audience(self, topic: Optional[str]) -> List[WebSocket]:
+        if topic is None:
+            return list(self.active)
+        targets = set(self.subscribers.get(topic, ()))
+        parent = topic.partition(":")[0]
+        if parent != topic:
+            targets |= self.subscribers.get(parent, set())
+        return list(targets)
+
+    def publish(self, message: Union[dict, str], topic: Optional[str] = None):
+        # Encode once for the whole audience rather than once per socket; sending happens
+        # on each socket's own drain task
+        text = message if isinstance(message, str) else dumps(message).decode()
+        for ws in self.audience(topic):
+            self.send(ws, text)
 
-    async def broadcast(self, message: dict):
-        dead = []
-        for ws in list(self.active):
-            try:
-                await ws.send_json(message)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(ws)
+    async def broadcast(self, message: Union[dict, str], topic: Optional[str] = None):
+        self.publish(message, topic)
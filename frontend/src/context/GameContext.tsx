@@ -55,7 +55,11 @@ export const GameProvider: React.FC<{ children: React.ReactNode }> = ({ children
   useEffect(() => {
     // Construct WebSocket URL based on current location
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${wsProtocol}//${window.location.host}/ws`;
+    // The host UI follows the "host" copy of state:update (the "tournament" copy omits answers)
+    const params = new URLSearchParams({ topics: 'host,match,leaderboard,sfx' });
+    const hostToken = new URLSearchParams(window.location.search).get('hostToken');
+    if (hostToken) params.set('hostToken', hostToken);
+    const wsUrl = `${wsProtocol}//${window.location.host}/ws?${params}`;
     const ws = new WebSocket(wsUrl);
     socketRef.current = ws;
 